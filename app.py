@@ -1,22 +1,43 @@
 import os
-import io
 import csv
 import glob
 import uuid
+import hashlib
 import json
-from datetime import datetime, timezone
-from functools import lru_cache
+import pickle
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
 
 from flask import (
     Flask, request, render_template, redirect, url_for, session,
-    send_file, abort, flash, jsonify
+    send_file, abort, flash, jsonify, make_response, g
 )
+import numpy as np
+import openpyxl
 import pandas as pd
+import xlsxwriter
+
+try:
+    import python_calamine  # קורא xlsx מהיר (Rust); אם לא מותקן נשארים עם openpyxl
+except ImportError:
+    python_calamine = None
+
+try:
+    # סשן בצד השרת: בעוגייה רק מזהה, הסל נשמר בקבצים תחת data/sessions
+    from flask_session import Session
+    from cachelib.file import FileSystemCache
+except ImportError:
+    Session = None
 
 # ------------ קונפיג ------------
 APP_SECRET = os.getenv("APP_SECRET", "change-me")
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "admin123")  # לאבטח בפרודקשן
 PORT = int(os.getenv("PORT", "10000"))
+# סל שלא נגעו בו יותר מזה נמחק מהשרת
+SESSION_LIFETIME_DAYS = int(os.getenv("SESSION_LIFETIME_DAYS", "7"))
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -28,32 +49,229 @@ CUSTOMER_ITEMS_DIR = os.path.join(BASE_DIR, "customer_items")
 EXPORT_MAPPING_XLSX = os.path.join(BASE_DIR, "export_mapping.xlsx")
 
 # קבצי לוג/הזמנות
-ORDERS_CSV = os.path.join(DATA_DIR, "orders.csv")  # כל שורה = פריט בהזמנה
+ORDERS_DB = os.path.join(DATA_DIR, "orders.db")  # טבלת orders: כל שורה = פריט בהזמנה
+ORDERS_CSV = os.path.join(DATA_DIR, "orders.csv")  # פורמט קודם — מיובא פעם אחת ל-ORDERS_DB
+ORDERS_COLUMNS = (
+    "OrderID", "TimestampUTC", "CustomerNumber", "CustomerName", "SalesManager",
+    "ItemCode", "ItemName", "Domain", "Category", "SubCategory", "Quantity",
+)
 
 # עמודות נדרשות
 REQUIRED_ITEMS = {"ItemCode", "ItemName", "Domain", "Category", "SubCategory"}
 REQUIRED_CUSTOMERS = {"CustomerNumber", "CustomerName", "SalesManager"}
 REQUIRED_CUSTOMER_ITEMS = {"CustomerNumber", "ItemCode"}
+REQUIRED_EXPORT_MAPPING = {"Field", "SAPField", "Order"}
+
+# ברירת מחדל למיפוי ייצוא (כשאין export_mapping.xlsx): מיפוי 1:1 לסאפ דמה
+DEFAULT_EXPORT_MAPPING = (
+    ("OrderID", "DOCNUM"),
+    ("TimestampUTC", "DOCDATE"),
+    ("CustomerNumber", "CUSTOMER"),
+    ("CustomerName", "CUSTNAME"),
+    ("SalesManager", "AGENT"),
+    ("ItemCode", "ITEMCODE"),
+    ("ItemName", "ITEMNAME"),
+    ("Quantity", "QTY"),
+)
+
+# סדר השדות בכל שורת פריט שנשלחת לטבלה ב-index.html
+ITEM_ROW_COLUMNS = ("Domain", "Category", "SubCategory", "ItemCode", "ItemName", "QtyInCart")
+
+# עותק מפוענח של קבצי האקסל (pickle), כדי שהפעלה מחדש / worker חדש לא יפרסרו שוב
+PARSED_CACHE_DIR = os.path.join(DATA_DIR, "parsed_cache")
+# להעלות בכל שינוי בקוד הקריאה/עיבוד העמודות, כדי שעותקים ישנים לא ימשיכו לשמש
+_PARSED_CACHE_VERSION = 2
+
+# עיצוב שורת הכותרות בייצוא (כמו של pandas.to_excel)
+EXPORT_HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+# קריאת xlsx במצב read-only (ללא DOM מלא, ערכים בלבד)
+OPENPYXL_READ_KWARGS = {"read_only": True, "data_only": True, "keep_links": False}
 
 # ------------ אפליקציה ------------
 app = Flask(__name__)
 app.secret_key = APP_SECRET
+if Session is not None:
+    # בלי זה כל הסל (JSON חתום) נשלח בעוגייה בכל בקשה ותגובה, ונחתך במגבלת 4KB של הדפדפן.
+    # קובץ סשן נוצר רק למי שיש לו סל (get_cart לא כותב לסשן); threshold גבוה כדי שניקוי לא יפיל סלים פעילים
+    app.config.update(
+        SESSION_TYPE="cachelib",
+        SESSION_CACHELIB=FileSystemCache(os.path.join(DATA_DIR, "sessions"), threshold=50000),
+        SESSION_PERMANENT=False,
+        PERMANENT_SESSION_LIFETIME=timedelta(days=SESSION_LIFETIME_DAYS),
+    )
+    Session(app)
+else:
+    app.logger.warning("Flask-Session is not installed; the cart is kept in the signed session cookie "
+                       "(4KB limit). Install Flask-Session for server-side sessions.")
+
+_orders_lock = threading.Lock()  # ייבוא ה-CSV הישן
+
+# נכלל ב-ETag כדי שאחרי פריסה (קוד/תבניות חדשים) הדפדפן לא יקבל 304 על דף ישן
+_BOOT_ID = uuid.uuid4().hex
 
 
 # ------------ עזרים ------------
-def _assert_columns(df: pd.DataFrame, required: set, fname: str):
-    missing = required.difference(df.columns)
+def _assert_columns(columns, required: set, fname: str):
+    missing = required.difference(columns)
     if missing:
         raise ValueError(f"{os.path.basename(fname)} missing columns: {missing}")
 
 
+def _parsed_cache_path(reader: str, path: str) -> str:
+    key = hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(PARSED_CACHE_DIR, f"{reader}.{os.path.basename(path)}.{key}.pkl")
+
+
+def _prune_parsed_cache(reader: str, live_paths):
+    # מוחק עותקים של קבצי מקור שכבר לא קיימים (למשל קובץ שהוסר מ-customer_items/)
+    keep = {_parsed_cache_path(reader, p) for p in live_paths if os.path.exists(p)}
+    for cached in glob.glob(os.path.join(PARSED_CACHE_DIR, f"{reader}.*.pkl")):
+        if cached not in keep:
+            try:
+                os.remove(cached)
+            except OSError:
+                pass
+
+
+def _disk_cached(fn):
+    """שומר את ה-DataFrame שנקרא מהקובץ ב-PARSED_CACHE_DIR; תקף כל עוד המקור (mtime וגודל),
+    גרסת הקוד (_PARSED_CACHE_VERSION) ומנוע הקריאה לא השתנו."""
+    @wraps(fn)
+    def wrapper(path: str) -> pd.DataFrame:
+        if not os.path.exists(path):
+            return fn(path)
+        st = os.stat(path)
+        engine = "calamine" if python_calamine is not None else "openpyxl"
+        sig = (_PARSED_CACHE_VERSION, engine, st.st_mtime_ns, st.st_size)
+        cache_path = _parsed_cache_path(fn.__name__, path)
+        try:
+            with open(cache_path, "rb") as f:
+                cached_sig, df = pickle.load(f)
+            if cached_sig == sig:
+                return df
+        except Exception:
+            pass  # אין עותק, או עותק מגרסת pandas אחרת — קוראים מהאקסל
+        df = fn(path)
+        # המטמון הוא best-effort: כל כשל בכתיבה (דיסק מלא, pickle) לא מפיל את הבקשה ולא משאיר קובץ זמני
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+            with open(tmp, "wb") as f:
+                pickle.dump((sig, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_path)  # אטומי — workers במקביל לא יראו קובץ חלקי
+        except Exception:
+            pass
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        return df
+    return wrapper
+
+
+@_disk_cached
 def _read_excel_safely(path: str) -> pd.DataFrame:
     if not os.path.exists(path):
         raise FileNotFoundError(f"Missing file: {os.path.basename(path)}")
+    if python_calamine is not None:
+        return pd.read_excel(path, dtype=str, engine="calamine").fillna("")
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        # בלי calamine: openpyxl read-only ישירות לשורות, בלי שכבת ההמרה של pd.read_excel
+        return _frame_from_rows(_read_sheet_rows(path))
     return pd.read_excel(path, dtype=str).fillna("")
 
 
-@lru_cache(maxsize=1)
+def _cell_str(v) -> str:
+    # כמו dtype=str של pandas: מספר שלם שנשמר כ-float לא יקבל ".0"
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v)
+
+
+def _header_names(cells: list) -> list:
+    # כמו מפענח הכותרות של pandas: כותרת ריקה -> "Unnamed: i"; כותרת חוזרת מקבלת סיומת
+    # ("Code", "Code.1", ...) שלא מתנגשת בשם קיים. כותרות עם שם מטופלות לפני הריקות.
+    names = [c or f"Unnamed: {i}" for i, c in enumerate(cells)]
+    unnamed = [i for i, c in enumerate(cells) if not c]
+    counts = {}
+    for i in [i for i in range(len(names)) if cells[i]] + unnamed:
+        col = old = names[i]
+        cur = counts.get(col, 0)
+        while cur > 0:
+            counts[old] = cur + 1
+            col = f"{old}.{cur}"
+            cur = cur + 1 if col in names else counts.get(col, 0)
+        names[i] = col
+        counts[col] = cur + 1
+    return names
+
+
+def _frame_from_rows(rows: list) -> pd.DataFrame:
+    # כמו pd.read_excel(dtype=str).fillna(""): שורה ראשונה = כותרות, שורות ריקות בסוף הגיליון נחתכות
+    if not rows:
+        return pd.DataFrame()
+    end = len(rows)
+    while end > 1 and all(v is None or v == "" for v in rows[end - 1]):
+        end -= 1
+    header = _header_names([_cell_str(h) for h in rows[0]])
+    width = len(header)
+    data = [[_cell_str(v) for v in r[:width]] + [""] * (width - len(r)) for r in rows[1:end]]
+    return pd.DataFrame(data, columns=header)
+
+
+def _read_sheet_rows(path: str) -> list:
+    # שורות הגיליון הראשון כערכים גולמיים (שורה ראשונה = כותרות)
+    if python_calamine is not None:
+        # skip_empty_area=False: שורות/עמודות ריקות בתחילת הגיליון נשמרות, כמו ב-pandas וב-openpyxl
+        sheet = python_calamine.CalamineWorkbook.from_path(path).get_sheet_by_index(0)
+        return sheet.to_python(skip_empty_area=False)
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        # read-only — בלי DOM מלא
+        wb = openpyxl.load_workbook(path, **OPENPYXL_READ_KWARGS)
+        try:
+            return list(wb.active.iter_rows(values_only=True))
+        finally:
+            wb.close()
+    t = _read_excel_safely(path)
+    return [t.columns.tolist()] + t.values.tolist()
+
+
+# ------------ מטמון לפי mtime ------------
+# שם טוען -> (חתימת קבצי מקור, תוצאה מעובדת). התוצאות משותפות בין בקשות — לא לשנות אותן במקום.
+_XLS_CACHE: dict = {}
+
+
+def _files_signature(paths) -> tuple:
+    return tuple((p, os.path.getmtime(p)) for p in paths if os.path.exists(p))
+
+
+def _customer_items_files() -> list:
+    return sorted(glob.glob(os.path.join(CUSTOMER_ITEMS_DIR, "*.xls*")))
+
+
+def _mtime_cached(paths_fn):
+    """טוען מחדש רק כאשר אחד מקבצי המקור השתנה (או נוסף/נמחק)."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper():
+            sig = _files_signature(paths_fn())
+            hit = _XLS_CACHE.get(fn.__name__)
+            if hit is not None and hit[0] == sig:
+                return hit[1]
+            result = fn()
+            _XLS_CACHE[fn.__name__] = (sig, result)
+            return result
+        wrapper.cache_clear = lambda: _XLS_CACHE.pop(fn.__name__, None)
+        return wrapper
+    return deco
+
+
+@_mtime_cached(lambda: [ITEMS_XLSX])
 def load_items() -> pd.DataFrame:
     df = _read_excel_safely(ITEMS_XLSX)
 
@@ -61,69 +279,196 @@ def load_items() -> pd.DataFrame:
     if "ItemName" not in df.columns and "ItemDescription" in df.columns:
         df = df.rename(columns={"ItemDescription": "ItemName"})
 
-    _assert_columns(df, REQUIRED_ITEMS, ITEMS_XLSX)
+    _assert_columns(df.columns, REQUIRED_ITEMS, ITEMS_XLSX)
     for c in REQUIRED_ITEMS:
         df[c] = df[c].str.strip()
 
     df = df.drop_duplicates(subset=["ItemCode"]).sort_values(
         ["Domain", "Category", "SubCategory", "ItemName", "ItemCode"], kind="stable"
     )
+    # שדות הטקסט לחיפוש חופשי במחרוזת אחת באותיות קטנות (מופרדים ב-\0), מחושב פעם אחת לכל גרסת קובץ.
+    # ItemCode לא כלול: הוא נבדק בנפרד ורגיש לאותיות, כמו בחיפוש המקורי
+    df["_search_lc"] = (
+        df["ItemName"] + "\0" + df["Domain"] + "\0" + df["Category"] + "\0" + df["SubCategory"]
+    ).str.lower()
+    # עמודות עם מעט ערכים שונים: categorical — השוואות על קודים שלמים ו-unique זול
+    for c in ("Domain", "Category", "SubCategory"):
+        df[c] = df[c].astype("category")
     return df.reset_index(drop=True)
 
 
-@lru_cache(maxsize=1)
+@_mtime_cached(lambda: [CUSTOMERS_XLSX])
 def load_customers() -> pd.DataFrame:
     df = _read_excel_safely(CUSTOMERS_XLSX)
-    _assert_columns(df, REQUIRED_CUSTOMERS, CUSTOMERS_XLSX)
+    _assert_columns(df.columns, REQUIRED_CUSTOMERS, CUSTOMERS_XLSX)
     for c in REQUIRED_CUSTOMERS:
         df[c] = df[c].str.strip()
     # לאפשר חיפוש/מיון נוח
     df["Display"] = df["CustomerNumber"] + " - " + df["CustomerName"]
+    # מספר + שם במחרוזת חיפוש אחת (מופרדים ב-\0 כדי שחיפוש לא "יחצה" בין השדות)
+    df["_search_cf"] = (df["CustomerNumber"] + "\0" + df["CustomerName"]).str.casefold()
+    df["SalesManager"] = df["SalesManager"].astype("category")
     return df.drop_duplicates(subset=["CustomerNumber"]).reset_index(drop=True)
 
 
-@lru_cache(maxsize=1)
+@_disk_cached
+def _read_customer_items_file(path: str) -> pd.DataFrame:
+    # קריאה ישירה של השורות — בלי DataFrame לכל הגיליון, רק שתי העמודות הדרושות
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Missing file: {os.path.basename(path)}")
+    rows = _read_sheet_rows(path)
+
+    header = [_cell_str(h).strip() for h in rows[0]] if rows else []
+    # תאימות לשמות עמודות שכיחים
+    if "CustomerID" in header and "CustomerNumber" not in header:
+        header[header.index("CustomerID")] = "CustomerNumber"
+    if "item_code" in header and "ItemCode" not in header:
+        header[header.index("item_code")] = "ItemCode"
+    _assert_columns(header, REQUIRED_CUSTOMER_ITEMS, path)
+
+    ci, ii = header.index("CustomerNumber"), header.index("ItemCode")
+    records = []
+    for r in rows[1:]:
+        cust = _cell_str(r[ci]).strip() if ci < len(r) else ""
+        code = _cell_str(r[ii]).strip() if ii < len(r) else ""
+        if cust or code:
+            records.append((cust, code))
+    return pd.DataFrame(records, columns=["CustomerNumber", "ItemCode"])
+
+
+# קובץ -> (mtime, DataFrame): כשקובץ אחד בתקייה משתנה, רק הוא נקרא מחדש
+_CUSTOMER_ITEMS_FRAMES: dict = {}
+
+
+@_mtime_cached(_customer_items_files)
 def load_customer_items() -> pd.DataFrame:
     # מאחד את כל הקבצים בתקייה customer_items/
-    files = sorted(glob.glob(os.path.join(CUSTOMER_ITEMS_DIR, "*.xls*")))
+    files = _customer_items_files()
+    _prune_parsed_cache(_read_customer_items_file.__name__, files)
+    # _read_excel_safely משמש לקבצים הקבועים וגם (בלי calamine) לקבצי xls ב-customer_items/
+    _prune_parsed_cache(_read_excel_safely.__name__, [ITEMS_XLSX, CUSTOMERS_XLSX, EXPORT_MAPPING_XLSX, *files])
     if not files:
         # אם אין—נחזיר טבלה ריקה עם העמודות הנכונות
+        _CUSTOMER_ITEMS_FRAMES.clear()
         return pd.DataFrame(columns=list(REQUIRED_CUSTOMER_ITEMS))
 
-    frames = []
+    fresh = {}
     for f in files:
-        t = _read_excel_safely(f)
-        # תאימות לשמות עמודות שכיחים
-        rename = {}
-        if "CustomerID" in t.columns and "CustomerNumber" not in t.columns:
-            rename["CustomerID"] = "CustomerNumber"
-        if "item_code" in t.columns and "ItemCode" not in t.columns:
-            rename["item_code"] = "ItemCode"
-        if rename:
-            t = t.rename(columns=rename)
-
-        _assert_columns(t, REQUIRED_CUSTOMER_ITEMS, f)
-        for c in REQUIRED_CUSTOMER_ITEMS:
-            t[c] = t[c].astype(str).str.strip()
-        frames.append(t[list(REQUIRED_CUSTOMER_ITEMS)])
-
-    df = pd.concat(frames, ignore_index=True).drop_duplicates()
+        mt = os.path.getmtime(f)
+        hit = _CUSTOMER_ITEMS_FRAMES.get(f)
+        fresh[f] = hit if hit is not None and hit[0] == mt else (mt, _read_customer_items_file(f))
+    # קבצים שנמחקו יוצאים מהמטמון
+    _CUSTOMER_ITEMS_FRAMES.clear()
+    _CUSTOMER_ITEMS_FRAMES.update(fresh)
+    frames = [fresh[f][1] for f in files]
+
+    # קובץ יחיד (המקרה הנפוץ) לא צריך concat
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    df = df.drop_duplicates()
     return df.reset_index(drop=True)
 
 
+@_mtime_cached(_customer_items_files)
+def load_allowed_codes() -> dict:
+    # CustomerNumber -> frozenset של ItemCode, כדי שסינון "פריטי לקוח" יהיה חיפוש במילון
+    df = load_customer_items()
+    return {cust: frozenset(codes) for cust, codes in df.groupby("CustomerNumber")["ItemCode"]}
+
+
+@_mtime_cached(lambda: [ITEMS_XLSX])
+def load_items_with_search() -> tuple:
+    # (items, (ItemCode, _search_lc) כמערכי unicode של numpy) — מאותה מסגרת, כך שהמסכה תמיד תואמת לשורות
+    items = load_items()
+    return items, (items["ItemCode"].to_numpy().astype("U"), items["_search_lc"].to_numpy().astype("U"))
+
+
+@_mtime_cached(lambda: [CUSTOMERS_XLSX])
+def load_customers_by_number() -> dict:
+    # CustomerNumber -> שורת הלקוח כמילון (ללקוח הנבחר ולשליחת הזמנה)
+    df = load_customers()
+    return dict(zip(df["CustomerNumber"], df.to_dict(orient="records")))
+
+
+@_mtime_cached(lambda: [ITEMS_XLSX])
+def load_items_by_code() -> dict:
+    # ItemCode -> שדות הפריט לסל, כדי שעדכון כמויות יהיה חיפוש במילון ולא סריקת טבלה
+    df = load_items()
+    records = df[["ItemCode", "ItemName", "Domain", "Category", "SubCategory"]].to_dict(orient="records")
+    return dict(zip(df["ItemCode"], records))
+
+
+@_mtime_cached(lambda: [CUSTOMERS_XLSX])
+def load_sales_managers() -> tuple:
+    return tuple(sorted(load_customers()["SalesManager"].drop_duplicates()))
+
+
+@lru_cache(maxsize=256)
+def _customer_options(sales_manager: str, customer_search: str, _sig: tuple) -> tuple:
+    # _sig (חתימת customers.xlsx) הוא חלק מהמפתח כדי שקובץ מעודכן לא יחזיר רשימה ישנה
+    customers = load_customers()
+    if sales_manager:
+        customers = customers[customers["SalesManager"] == sales_manager]
+    if customer_search:
+        customers = customers[
+            customers["_search_cf"].str.contains(customer_search.casefold(), regex=False)
+        ]
+    return tuple(customers[["CustomerNumber", "Display"]].to_dict(orient="records"))
+
+
+def _filter_options(items_df: pd.DataFrame) -> tuple:
+    # (domains, categories, subcategories) ממוינים. הקטגוריות של העמודות כבר ממוינות מהטעינה,
+    # ולכן מספיק להשאיר את אלה שבשימוש — בלי unique ומיון מחרוזות בכל בקשה
+    return tuple(
+        tuple(items_df[c].cat.remove_unused_categories().cat.categories)
+        for c in ("Domain", "Category", "SubCategory")
+    )
+
+
+@lru_cache(maxsize=512)
+def _scope_filter_options(customer_number: str, _sig: tuple) -> tuple:
+    # אפשרויות הסינון לסט הבסיסי של לקוח ("" = כלל הפריטים), לפני סינון דומיין/קטגוריה/חיפוש
+    items = load_items()
+    if customer_number:
+        items = items[items["ItemCode"].isin(load_allowed_codes().get(customer_number, frozenset()))]
+    return _filter_options(items)
+
+
 def get_cart() -> dict:
-    return session.setdefault("cart", {})  # { ItemCode: {..., qty:int} }
+    # { ItemCode: qty } — שם/דומיין/קטגוריות נשלפים מ-load_items_by_code רק כשצריך להציג/לשמור
+    # קריאה בלבד — סל ריק לא יוצר סשן; כל שינוי עובר דרך save_cart
+    cart = session.get("cart", {})
+    if any(isinstance(v, dict) for v in cart.values()):
+        # סשן מהמבנה הקודם (שורת פריט מלאה לכל קוד)
+        cart = {code: v["qty"] if isinstance(v, dict) else v for code, v in cart.items()}
+        save_cart(cart)
+    return cart
 
 
 def save_cart(cart: dict):
     session["cart"] = cart
-    session.modified = True
+
+
+def _cart_size(cart: dict) -> int:
+    # רק פריטים שעדיין קיימים ב-items.xlsx (פריט שירד מהקטלוג לא מוצג ולא יישלח)
+    items_by_code = load_items_by_code()
+    return sum(qty for code, qty in cart.items() if code in items_by_code)
+
+
+def _order_form_etag(cart: dict) -> str:
+    # הדף תלוי רק בקבצי המקור, בפרמטרי ה-URL ובסל — אם אף אחד מהם לא השתנה אין צורך לרנדר מחדש
+    key = json.dumps([
+        _BOOT_ID,
+        _files_signature([CUSTOMERS_XLSX, ITEMS_XLSX, *_customer_items_files()]),
+        sorted(request.args.items(multi=True)),
+        cart,
+    ], sort_keys=True, default=str)
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
 
 
 def _prefill_qtys(items_df: pd.DataFrame, cart: dict) -> pd.DataFrame:
-    items_df = items_df.copy()
-    items_df["QtyInCart"] = items_df["ItemCode"].map(lambda c: cart.get(c, {}).get("qty", 0))
-    return items_df
+    # assign מחזיר מסגרת חדשה בלי להעתיק את העמודות הקיימות (copy-on-write);
+    # map עם מילון הוא חיפוש hash וקטורי, בלי קריאת lambda לכל שורה
+    return items_df.assign(QtyInCart=items_df["ItemCode"].map(cart).fillna(0).astype("int64"))
 
 
 # ------------ Health ------------
@@ -135,9 +480,13 @@ def health():
 # ------------ דף ראשי + סינון ------------
 @app.route("/", methods=["GET", "POST"])
 def order_form():
-    customers = load_customers()
-    items = load_items()
-    cust_items = load_customer_items()
+    etag = None
+    if request.method == "GET":
+        etag = _order_form_etag(get_cart())
+        if request.if_none_match.contains(etag):
+            resp = make_response("", 304)
+            resp.set_etag(etag)
+            return resp
 
     # פרמטרים מהטופס/URL
     sales_manager = (request.values.get("sales_manager") or "").strip()
@@ -149,74 +498,23 @@ def order_form():
     subcategory = (request.values.get("subcategory") or "").strip()
     q = (request.values.get("q") or "").strip()
 
-    # סינון לקוחות
-    customers_filtered = customers.copy()
-    if sales_manager:
-        customers_filtered = customers_filtered[customers_filtered["SalesManager"] == sales_manager]
-    if customer_search:
-        s = customer_search.lower()
-        customers_filtered = customers_filtered[
-            customers_filtered["CustomerName"].str.lower().str.contains(s)
-            | customers_filtered["CustomerNumber"].str.contains(customer_search)
-        ]
-
-    # אם לא נבחר customer_id אבל יש רשימה אחרי סינון—נשאיר ריק. המשתמש יבחר.
-    selected_customer = None
-    if customer_id:
-        selected = customers[customers["CustomerNumber"] == customer_id]
-        if not selected.empty:
-            selected_customer = selected.iloc[0].to_dict()
-
-    # בסיס סט הפריטים
-    if items_scope == "customer" and selected_customer:
-        allowed = cust_items[cust_items["CustomerNumber"] == selected_customer["CustomerNumber"]]["ItemCode"]
-        items_base = items[items["ItemCode"].isin(allowed)]
-    else:
-        items_base = items
-
-    # סינוני דומיין/קטגוריות
-    if domain:
-        items_base = items_base[items_base["Domain"] == domain]
-    if category:
-        items_base = items_base[items_base["Category"] == category]
-    if subcategory:
-        items_base = items_base[items_base["SubCategory"] == subcategory]
-
-    # חיפוש חופשי
-    if q:
-        qs = q.lower()
-        items_base = items_base[
-            items_base["ItemCode"].str.contains(q)
-            | items_base["ItemName"].str.lower().str.contains(qs)
-            | items_base["Domain"].str.lower().str.contains(qs)
-            | items_base["Category"].str.lower().str.contains(qs)
-            | items_base["SubCategory"].str.lower().str.contains(qs)
-        ]
-
     # שמירת כמויות מהטופס (לא מאפסת סל!)
     cart = get_cart()
     if request.method == "POST":
-        posted = request.form.to_dict(flat=False)
-        qtys = posted.get("qty", [])
-        codes = posted.get("code", [])
+        # ב-POST צריך רק את פרטי הפריטים — בלי לקוחות וסינונים
+        items_by_code = load_items_by_code()
+        # רק שני השדות הרלוונטיים — בלי לבנות מילון מכל שדות הטופס
+        codes = request.form.getlist("code")
+        qtys = request.form.getlist("qty")
         for code, qty_str in zip(codes, qtys):
             try:
                 qty = int(qty_str or 0)
             except ValueError:
                 qty = 0
             if qty > 0:
-                row = items[items["ItemCode"] == code]
-                if row.empty:
+                if code not in items_by_code:
                     continue
-                r = row.iloc[0]
-                cart[code] = {
-                    "qty": qty,
-                    "ItemCode": r["ItemCode"],
-                    "ItemName": r["ItemName"],
-                    "Domain": r["Domain"],
-                    "Category": r["Category"],
-                    "SubCategory": r["SubCategory"],
-                }
+                cart[code] = qty
             else:
                 # אם המשתמש רוקן—נמחוק מהסל
                 cart.pop(code, None)
@@ -232,74 +530,157 @@ def order_form():
                                 subcategory=subcategory,
                                 q=q))
 
+    items, items_search = load_items_with_search()
+
+    # סינון לקוחות (ממוטמן לפי מנהל/חיפוש + mtime של customers.xlsx)
+    customer_options = _customer_options(sales_manager, customer_search,
+                                         _files_signature([CUSTOMERS_XLSX]))
+
+    # אם לא נבחר customer_id אבל יש רשימה אחרי סינון—נשאיר ריק. המשתמש יבחר.
+    selected_customer = load_customers_by_number().get(customer_id) if customer_id else None
+
+    # בסיס סט הפריטים ("" = כלל הפריטים)
+    scope_customer = selected_customer["CustomerNumber"] if items_scope == "customer" and selected_customer else ""
+    # סט הלקוח, סינוני דומיין/קטגוריות וחיפוש חופשי — מסכה אחת על הטבלה המלאה ושליפה אחת, בלי מסגרות ביניים
+    items_base = items
+    if scope_customer or domain or category or subcategory or q:
+        # מערך bool של numpy — בלי Series/אינדקס לכל השוואה; בעמודות categorical ההשוואה היא על קודים
+        mask = np.ones(len(items), dtype=bool)
+        if scope_customer:
+            mask &= items["ItemCode"].isin(load_allowed_codes().get(scope_customer, frozenset())).to_numpy()
+        if domain:
+            mask &= items["Domain"].array == domain
+        if category:
+            mask &= items["Category"].array == category
+        if subcategory:
+            mask &= items["SubCategory"].array == subcategory
+        if q:
+            # חיפוש תת-מחרוזת בלולאת C של numpy, בלי קריאת פייתון לכל שורה
+            codes, texts = items_search
+            mask &= (np.char.find(codes, q) >= 0) | (np.char.find(texts, q.lower()) >= 0)
+        items_base = items.iloc[np.flatnonzero(mask)]
+
     # מילוי כמויות קיימות
     items_view = _prefill_qtys(items_base, cart)
 
-    # דרופדאונים לדומיין/קטגוריה מתבססים על הסט הנוכחי (בהתאם ל־items_scope)
-    domains = sorted(items[(items_scope=="all")][["Domain"]].drop_duplicates()["Domain"]) if False else \
-              sorted(items_base["Domain"].drop_duplicates())
-    categories = sorted(items_base["Category"].drop_duplicates())
-    subcategories = sorted(items_base["SubCategory"].drop_duplicates())
+    # דרופדאונים לדומיין/קטגוריה מתבססים על הסט הנוכחי (בהתאם ל־items_scope);
+    # בלי סינון נוסף הם תלויים רק בלקוח — ואז נלקחים מהמטמון
+    if domain or category or subcategory or q:
+        domains, categories, subcategories = _filter_options(items_base)
+    else:
+        domains, categories, subcategories = _scope_filter_options(
+            scope_customer, _files_signature([ITEMS_XLSX, *_customer_items_files()]))
 
-    sales_managers = sorted(load_customers()["SalesManager"].drop_duplicates())
+    sales_managers = load_sales_managers()
 
-    return render_template(
+    resp = make_response(render_template(
         "index.html",
         sales_managers=sales_managers,
-        customers=customers_filtered.to_dict(orient="records"),
+        customers=customer_options,
         selected_customer=selected_customer,
-        items=items_view.to_dict(orient="records"),
+        items=list(zip(*(items_view[c].tolist() for c in ITEM_ROW_COLUMNS))),
         items_scope=items_scope,
         sales_manager=sales_manager,
         customer_search=customer_search,
         customer_id=customer_id,
         domain=domain, category=category, subcategory=subcategory, q=q,
-        cart_size=sum(x.get("qty", 0) for x in cart.values()),
+        cart_size=_cart_size(cart),
         domains=domains, categories=categories, subcategories=subcategories
-    )
+    ))
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 
 # ------------ סל ------------
 @app.route("/cart", methods=["GET", "POST"])
 def cart_view():
-    items = load_items()
+    items_by_code = load_items_by_code()
     cart = get_cart()
 
     if request.method == "POST":
         # עדכון כמויות/מחיקות מתוך הסל
-        for code, entry in list(cart.items()):
+        for code, old_qty in list(cart.items()):
             qty_str = request.form.get(f"qty_{code}", "")
             try:
                 qty = int(qty_str or 0)
             except ValueError:
-                qty = entry.get("qty", 0)
+                qty = old_qty
             if qty <= 0:
                 cart.pop(code, None)
             else:
-                cart[code]["qty"] = qty
+                cart[code] = qty
         save_cart(cart)
         return redirect(url_for("cart_view"))
 
     # בניית טבלת תצוגה
     rows = []
-    for code, entry in cart.items():
-        r = items[items["ItemCode"] == code]
-        if r.empty:
+    for code, qty in cart.items():
+        item = items_by_code.get(code)
+        # פריט שירד מ-items.xlsx לא מוצג
+        if item is None:
             continue
-        rows.append({
-            "ItemCode": code,
-            "ItemName": entry["ItemName"],
-            "Domain": entry["Domain"],
-            "Category": entry["Category"],
-            "SubCategory": entry["SubCategory"],
-            "qty": entry["qty"]
-        })
+        rows.append({**item, "qty": qty})
 
     rows = sorted(rows, key=lambda r: (r["Domain"], r["Category"], r["SubCategory"], r["ItemName"], r["ItemCode"]))
-    return render_template("cart.html", rows=rows, cart_size=sum(x["qty"] for x in cart.values()))
+    return render_template("cart.html", rows=rows, cart_size=_cart_size(cart))
+
+
+# ------------ אחסון הזמנות (SQLite) ------------
+_ORDERS_SCHEMA = f"""
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS orders (
+    {", ".join(f"{c} INTEGER" if c == "Quantity" else f"{c} TEXT" for c in ORDERS_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS ix_orders_ts ON orders (TimestampUTC);
+CREATE INDEX IF NOT EXISTS ix_orders_customer ON orders (CustomerNumber);
+"""
+_INSERT_ORDER_SQL = (
+    f"INSERT INTO orders ({', '.join(ORDERS_COLUMNS)}) VALUES ({', '.join('?' * len(ORDERS_COLUMNS))})"
+)
+
+
+def _import_legacy_orders_csv(con: sqlite3.Connection):
+    # מעבר מ-orders.csv: מייבאים פעם אחת, רק אם הטבלה עדיין ריקה. הקובץ עצמו נשאר כגיבוי.
+    if not os.path.exists(ORDERS_CSV) or con.execute("SELECT 1 FROM orders LIMIT 1").fetchone():
+        return
+    with open(ORDERS_CSV, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = [tuple(r.get(c) or "" for c in ORDERS_COLUMNS) for r in reader]
+    with con:
+        con.executemany(_INSERT_ORDER_SQL, rows)
+
+
+_legacy_imported = False  # ייבוא ה-CSV הישן — פעם אחת לכל תהליך
+
 
+def _orders_db() -> sqlite3.Connection:
+    # חיבור אחד לכל בקשה (נשמר על g ונסגר ב-teardown)
+    global _legacy_imported
+    con = g.get("orders_con")
+    if con is not None:
+        return con
+    con = g.orders_con = sqlite3.connect(ORDERS_DB)
+    # WAL (נשמר בקובץ עצמו): כתיבה לא חוסמת קריאות של הייצוא; NORMAL חוסך fsync בכל commit
+    con.execute("PRAGMA synchronous=NORMAL")
+    # הסכמה בכל חיבור (IF NOT EXISTS — זול), כך ש-orders.db שנמחק/הוחלף בזמן ריצה נוצר מחדש בלי restart
+    con.executescript(_ORDERS_SCHEMA)
+    if not _legacy_imported:
+        with _orders_lock:
+            if not _legacy_imported:
+                _import_legacy_orders_csv(con)
+                _legacy_imported = True
+    return con
 
-# ------------ שליחת הזמנה (שומר לקובץ CSV) ------------
+
+@app.teardown_appcontext
+def _close_orders_db(exc):
+    con = g.pop("orders_con", None)
+    if con is not None:
+        con.close()
+
+
+# ------------ שליחת הזמנה (שומר ל-SQLite) ------------
 @app.route("/submit-order", methods=["POST"])
 def submit_order():
     cart = get_cart()
@@ -308,58 +689,65 @@ def submit_order():
         return redirect(url_for("order_form"))
 
     customer_id = request.form.get("customer_id") or ""
-    customers = load_customers()
-    c = customers[customers["CustomerNumber"] == customer_id]
-    if c.empty:
+    cust = load_customers_by_number().get(customer_id)
+    if cust is None:
         flash("לקוח לא נבחר או לא תקין.")
         return redirect(url_for("cart_view"))
 
-    cust = c.iloc[0].to_dict()
+    # פריטים שירדו מ-items.xlsx: לא שומרים הזמנה חלקית בשקט — מסירים אותם מהסל ומחזירים לסל לאישור
+    items_by_code = load_items_by_code()
+    missing = [code for code in cart if code not in items_by_code]
+    if missing:
+        for code in missing:
+            cart.pop(code, None)
+        save_cart(cart)
+        flash(f"הפריטים הבאים כבר לא קיימים בקטלוג והוסרו מהסל: {', '.join(missing)}. ההזמנה לא נשלחה.")
+        return redirect(url_for("cart_view"))
+
     order_id = str(uuid.uuid4())[:8].upper()
     ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
-    # כתיבה ל-CSV (שורה לכל פריט)
-    is_new = not os.path.exists(ORDERS_CSV)
-    with open(ORDERS_CSV, "a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if is_new:
-            w.writerow([
-                "OrderID", "TimestampUTC", "CustomerNumber", "CustomerName", "SalesManager",
-                "ItemCode", "ItemName", "Domain", "Category", "SubCategory", "Quantity"
-            ])
-        for code, entry in cart.items():
-            w.writerow([
-                order_id, ts, cust["CustomerNumber"], cust["CustomerName"], cust["SalesManager"],
-                entry["ItemCode"], entry["ItemName"], entry["Domain"], entry["Category"], entry["SubCategory"],
-                entry["qty"]
-            ])
+    # שורה לכל פריט, INSERT אחד בטרנזקציה אחת. פרטי הפריט מהקטלוג הנוכחי
+    rows = []
+    for code, qty in cart.items():
+        item = items_by_code[code]
+        rows.append((order_id, ts, cust["CustomerNumber"], cust["CustomerName"], cust["SalesManager"],
+                     item["ItemCode"], item["ItemName"], item["Domain"], item["Category"], item["SubCategory"],
+                     qty))
+    with _orders_db() as con:
+        con.executemany(_INSERT_ORDER_SQL, rows)
 
     # איפוס סל
-    session["cart"] = {}
+    session.pop("cart", None)
     flash(f"הזמנה {order_id} נשמרה בהצלחה.")
     return redirect(url_for("order_form", customer_id=cust["CustomerNumber"]))
 
 
 # ------------ ייצוא לאקסל (אדמין) ------------
+@_mtime_cached(lambda: [EXPORT_MAPPING_XLSX])
 def _load_export_mapping():
     if not os.path.exists(EXPORT_MAPPING_XLSX):
-        # ברירת מחדל: מיפוי 1:1 לסאפ דמה
-        return pd.DataFrame([
-            {"Field": "OrderID", "SAPField": "DOCNUM", "Order": 1},
-            {"Field": "TimestampUTC", "SAPField": "DOCDATE", "Order": 2},
-            {"Field": "CustomerNumber", "SAPField": "CUSTOMER", "Order": 3},
-            {"Field": "CustomerName", "SAPField": "CUSTNAME", "Order": 4},
-            {"Field": "SalesManager", "SAPField": "AGENT", "Order": 5},
-            {"Field": "ItemCode", "SAPField": "ITEMCODE", "Order": 6},
-            {"Field": "ItemName", "SAPField": "ITEMNAME", "Order": 7},
-            {"Field": "Quantity", "SAPField": "QTY", "Order": 8},
-        ])
+        return pd.DataFrame(
+            [{"Field": f, "SAPField": sap, "Order": i} for i, (f, sap) in enumerate(DEFAULT_EXPORT_MAPPING, 1)]
+        )
     m = _read_excel_safely(EXPORT_MAPPING_XLSX)
     m = m.rename(columns={c: c.strip() for c in m.columns})
-    _assert_columns(m, {"Field", "SAPField", "Order"}, EXPORT_MAPPING_XLSX)
+    _assert_columns(m.columns, REQUIRED_EXPORT_MAPPING, EXPORT_MAPPING_XLSX)
     return m
 
 
+@_mtime_cached(lambda: [EXPORT_MAPPING_XLSX])
+def _export_columns() -> tuple:
+    # (עמודות המקור לפי Order, כותרות SAP בהתאם) — מחושב פעם אחת לכל גרסת קובץ המיפוי.
+    # Order נקרא מהקובץ כמחרוזת, ולכן ממיינים לפי ערך מספרי ("10" אחרי "2")
+    mapping = _load_export_mapping().sort_values(
+        "Order", key=lambda s: pd.to_numeric(s, errors="coerce"), kind="stable"
+    )
+    # רק שדות שקיימים בטבלת ההזמנות (שמות העמודות ב-SQL מגיעים מ-ORDERS_COLUMNS בלבד)
+    pairs = [(f, sap) for f, sap in zip(mapping["Field"], mapping["SAPField"]) if f in ORDERS_COLUMNS]
+    return tuple(f for f, _ in pairs), tuple(sap for _, sap in pairs)
+
+
 @app.route("/admin/export")
 def admin_export():
     token = request.args.get("token", "")
@@ -370,28 +758,41 @@ def admin_export():
     date_from = request.args.get("from", "")
     date_to = request.args.get("to", "")
 
-    if not os.path.exists(ORDERS_CSV):
-        return jsonify({"message": "no orders yet"}), 200
-
-    df = pd.read_csv(ORDERS_CSV, dtype=str).fillna("")
-    # סינון לפי תאריכים אם סופק
+    # סינון לפי תאריכים בשאילתה (אינדקס על TimestampUTC); חותמות הזמן בפורמט ISO ולכן השוואת מחרוזות שקולה להשוואת זמנים
+    where, params = [], []
     if date_from:
-        df = df[df["TimestampUTC"] >= f"{date_from} 00:00:00"]
+        where.append("TimestampUTC >= ?")
+        params.append(f"{date_from} 00:00:00")
     if date_to:
-        df = df[df["TimestampUTC"] <= f"{date_to} 23:59:59"]
-
-    mapping = _load_export_mapping().sort_values("Order")
-    # בונים טבלה לפי סדר עמודות המיפוי
-    cols_in = [c for c in mapping["Field"] if c in df.columns]
-    df = df[cols_in].copy()
-    rename_map = dict(zip(mapping["Field"], mapping["SAPField"]))
-    df = df.rename(columns=rename_map)
-
-    # יצוא לאקסל בזיכרון
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="EXPORT", index=False)
-    output.seek(0)
+        where.append("TimestampUTC <= ?")
+        params.append(f"{date_to} 23:59:59")
+
+    # שולפים רק את עמודות המיפוי, כבר בסדר הנכון
+    cols_in, headers = _export_columns()
+    sql = f"SELECT {', '.join(cols_in) or 'NULL'} FROM orders"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY rowid"
+
+    con = _orders_db()
+    if not con.execute("SELECT 1 FROM orders LIMIT 1").fetchone():
+        return jsonify({"message": "no orders yet"}), 200
+
+    # יצוא לקובץ זמני אנונימי ושליחה ישירות ממנו (sendfile) — בלי עותק נוסף של הקובץ בזיכרון.
+    # הקובץ נמחק אוטומטית כשהשרת סוגר אותו בסוף השליחה.
+    output = tempfile.TemporaryFile(suffix=".xlsx")
+    try:
+        # שורות נכתבות ישר מה-cursor, בלי DataFrame. הכתיבה לפי סדר שורות, ולכן constant_memory תקין כאן
+        wb = xlsxwriter.Workbook(output, {"constant_memory": True})
+        ws = wb.add_worksheet("EXPORT")
+        ws.write_row(0, 0, headers, wb.add_format(EXPORT_HEADER_FORMAT))
+        for r, row in enumerate(con.execute(sql, params), 1):
+            ws.write_row(r, 0, ["" if v is None else str(v) for v in row[:len(cols_in)]])
+        wb.close()
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
     filename = f"export_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
     return send_file(output, as_attachment=True, download_name=filename,
                      mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
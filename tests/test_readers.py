@@ -0,0 +1,80 @@
+import os
+import sys
+
+import openpyxl
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+HEADERS = [
+    ["Code", "Name", "Code", "Code.1", None, "Code"],
+    ["a", "a", "a.1", "a", "a.2"],
+    ["x", None, "Unnamed: 1", None, "x"],
+]
+ROWS = [
+    [100, "a", "x", 1.0, "n1", 7],
+    ["B-2", None, 3.5, "y", None, ""],
+    [None, None, None, None, None, None],
+]
+
+
+@pytest.fixture(params=HEADERS)
+def sheet_path(request, tmp_path):
+    path = tmp_path / "dup_headers.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(request.param)
+    for r in ROWS:
+        ws.append(r[:len(request.param)])
+    wb.save(path)
+    return str(path)
+
+
+def _openpyxl_rows(path):
+    wb = openpyxl.load_workbook(path, **app.OPENPYXL_READ_KWARGS)
+    try:
+        return list(wb.active.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def test_frame_from_rows_matches_read_excel_on_repeated_headers(sheet_path):
+    expected = pd.read_excel(sheet_path, dtype=str, engine="openpyxl").fillna("")
+    got = app._frame_from_rows(_openpyxl_rows(sheet_path))
+    assert list(got.columns) == list(expected.columns)
+    assert got.columns.is_unique
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+@pytest.mark.skipif(app.python_calamine is None, reason="python-calamine not installed")
+def test_fallback_matches_calamine_on_repeated_headers(sheet_path):
+    expected = pd.read_excel(sheet_path, dtype=str, engine="calamine").fillna("")
+    got = app._frame_from_rows(_openpyxl_rows(sheet_path))
+    assert list(got.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+@pytest.fixture
+def leading_blank_path(tmp_path):
+    # שורה ועמודה ריקות לפני הכותרות
+    path = tmp_path / "leading_blank.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws["B2"], ws["C2"] = "Code", "Name"
+    ws["B3"], ws["C3"] = 1, "a"
+    ws["B4"] = "x"
+    wb.save(path)
+    return str(path)
+
+
+@pytest.mark.skipif(app.python_calamine is None, reason="python-calamine not installed")
+def test_sheet_rows_keep_leading_blank_area(leading_blank_path):
+    expected = pd.read_excel(leading_blank_path, dtype=str, engine="calamine").fillna("")
+    calamine_frame = app._frame_from_rows(app._read_sheet_rows(leading_blank_path))
+    openpyxl_frame = app._frame_from_rows(_openpyxl_rows(leading_blank_path))
+    pd.testing.assert_frame_equal(calamine_frame, expected, check_dtype=False)
+    pd.testing.assert_frame_equal(openpyxl_frame, expected, check_dtype=False)